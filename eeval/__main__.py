@@ -1,10 +1,10 @@
 """CLI for using eeval"""
 
 import logging
+import os
 import tenseal as ts
 import typer
-import pickle
-import numpy as np
+from contextlib import contextmanager
 from typing import List, Tuple
 from pathlib import Path
 from eeval.client import Client
@@ -18,7 +18,8 @@ app = typer.Typer()
 
 
 def check_power_of_two(value: int) -> int:
-    if value & (value - 1) != 0 or value <= 0:
+    # check the sign first, the bit trick only holds for positive values
+    if value <= 0 or value & (value - 1) != 0:
         raise typer.BadParameter("Only powers of two greater than zero are allowed")
     return value
 
@@ -33,6 +34,41 @@ def log(msg, verbosity=1):
         typer.echo(msg)
 
 
+def check_output_path(path: Path) -> Path:
+    # outputs are only opened once the command is done, make sure they can be written to first
+    if str(path) != "-" and not path.parent.is_dir():
+        raise typer.BadParameter(f"Directory '{path.parent}' doesn't exist")
+    return path
+
+
+@contextmanager
+def open_output(path: Path):
+    """Open a temporary file for writing, that only replaces `path` once writing succeeds.
+    A failing command doesn't leave a truncated output file behind. `-` writes to stdout."""
+    if str(path) == "-":
+        yield typer.get_binary_stream("stdout")
+        return
+
+    tmp_path = path.with_name(path.name + ".part")
+    try:
+        f = open(tmp_path, "wb")
+    except OSError as e:
+        typer.echo(f"Couldn't open output file: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+
+    try:
+        with f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException as e:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        if isinstance(e, OSError):
+            typer.echo(f"Couldn't write output file: {str(e)}", err=True)
+            raise typer.Exit(code=1)
+        raise
+
+
 def load_ctx_and_input(
     context_file: typer.FileBinaryRead, input_file: typer.FileBinaryRead = None
 ) -> Tuple[ts._ts_cpp.TenSEALContext, ts._ts_cpp.CKKSVector]:
@@ -62,8 +98,8 @@ def ping(
     port: int = typer.Option(8000, "--port", "-p", min=1, max=65535, help="port"),
 ):
     """Check if the API at URL is up"""
-    client = Client(hostname, port)
-    is_up = client.ping()
+    with Client(hostname, port) as client:
+        is_up = client.ping()
     if is_up:
         typer.secho("API is up", fg=typer.colors.GREEN)
     else:
@@ -81,11 +117,11 @@ def list_models(
     ),
 ):
     """List models available"""
-    client = Client(hostname, port)
-    try:
-        models = client.list_models()
-    except ConnectionError:
-        couldnt_connect(hostname, port)
+    with Client(hostname, port) as client:
+        try:
+            models = client.list_models()
+        except ConnectionError:
+            couldnt_connect(hostname, port)
 
     if len(models) == 0:
         typer.echo("No model available!")
@@ -121,15 +157,15 @@ def model_info(
     model_name: str = typer.Argument(...),
 ):
     """Get information about a specific model"""
-    client = Client(hostname, port)
-    try:
-        model = client.model_info(model_name)
-    except Answer418 as e:
-        assert "can't be found" in str(e)
-        typer.echo(f"Model `{model_name}` doesn't exist", err=True)
-        raise typer.Exit(code=1)
-    except ConnectionError:
-        couldnt_connect(hostname, port)
+    with Client(hostname, port) as client:
+        try:
+            model = client.model_info(model_name)
+        except Answer418 as e:
+            assert "can't be found" in str(e)
+            typer.echo(f"Model `{model_name}` doesn't exist", err=True)
+            raise typer.Exit(code=1)
+        except ConnectionError:
+            couldnt_connect(hostname, port)
 
     typer.echo(f"[+] Model {model['model_name']}:")
     typer.echo(f"[*] Description: {model['description']}")
@@ -155,8 +191,11 @@ def evaluate(
     input_file: typer.FileBinaryRead = typer.Argument(
         ..., help="file to load the input from"
     ),
-    output_file: typer.FileBinaryWrite = typer.Argument(
-        ..., help="file to write the encrypted output to"
+    output_file: Path = typer.Argument(
+        ...,
+        dir_okay=False,
+        callback=check_output_path,
+        help="file to write the encrypted output to (- for stdout)",
     ),
     send_secret_key: bool = typer.Option(
         False,
@@ -167,13 +206,21 @@ def evaluate(
     decrypt_result: bool = typer.Option(
         False, "--decrypt", "-d", help="decrypt result",
     ),
+    compress: bool = typer.Option(
+        False,
+        "--compress",
+        "-z",
+        help="compress the request using zstd (requires zstandard)",
+    ),
 ):
     """Evaluate an encrypted input on a remote hosted model"""
 
     ctx, enc_input = load_ctx_and_input(context_file, input_file)
 
     ctx_holds_sk = ctx.is_private()
-    sk = ctx.secret_key() if ctx_holds_sk else None
+    # only keep a copy of the secret key if it's needed for decrypting the result
+    sk = ctx.secret_key() if ctx_holds_sk and decrypt_result else None
+    # drop the secret key before the client serializes the context
     if not send_secret_key:
         if ctx_holds_sk:
             ctx.make_context_public()
@@ -181,21 +228,27 @@ def evaluate(
         else:
             log("context doesn't hold a secret key, nothing to drop")
 
-    client = Client(hostname, port)
     try:
-        enc_out = client.evaluate(model_name, ctx, enc_input)
-    except Answer418 as e:
-        if "can't be found" in str(e):
-            typer.echo(f"Model `{model_name}` doesn't exist", err=True)
-        else:
-            typer.echo(f"Error: {str(e)}", err=True)
-        raise typer.Exit(code=1)
-    except ConnectionError:
-        couldnt_connect(hostname, port)
-    except ServerError:
-        typer.echo("Server side error", err=True)
+        client = Client(hostname, port, compress=compress)
+    except ImportError as e:
+        typer.echo(f"Error: {str(e)}", err=True)
         raise typer.Exit(code=1)
 
+    with client:
+        try:
+            enc_out = client.evaluate(model_name, ctx, enc_input)
+        except Answer418 as e:
+            if "can't be found" in str(e):
+                typer.echo(f"Model `{model_name}` doesn't exist", err=True)
+            else:
+                typer.echo(f"Error: {str(e)}", err=True)
+            raise typer.Exit(code=1)
+        except ConnectionError:
+            couldnt_connect(hostname, port)
+        except ServerError:
+            typer.echo("Server side error", err=True)
+            raise typer.Exit(code=1)
+
     out = None
     if decrypt_result:
         if ctx_holds_sk:
@@ -207,10 +260,14 @@ def evaluate(
             )
 
     if out:  # decrypted
-        pickle.dump(out, output_file)
+        import numpy as np
+
+        with open_output(output_file) as f:
+            np.save(f, np.asarray(out))
         log("saved decrypted result to output file")
     else:
-        output_file.write(enc_out.serialize())
+        with open_output(output_file) as f:
+            f.write(enc_out.serialize())
         log("saved encrypted result to output file")
 
 
@@ -222,19 +279,25 @@ def decrypt(
     input_file: typer.FileBinaryRead = typer.Argument(
         ..., help="file to load the tensor to decrypt from"
     ),
-    output_file: typer.FileBinaryWrite = typer.Argument(
-        ..., help="file to save the plain tensor to"
+    output_file: Path = typer.Argument(
+        ...,
+        dir_okay=False,
+        callback=check_output_path,
+        help="file to save the plain tensor to (in numpy .npy format) (- for stdout)",
     ),
 ):
     """Decrypt a saved tensor"""
 
+    import numpy as np
+
     ctx, enc_input = load_ctx_and_input(context_file, input_file)
     if not ctx.is_private():
         typer.echo("Context doesn't hold a secret key, can't decrypt tensor", err=True)
         raise typer.Exit(code=1)
     result = enc_input.decrypt()
     log(f"decryption completed, result is: {result}")
-    pickle.dump(result, output_file)
+    with open_output(output_file) as f:
+        np.save(f, np.asarray(result))
     log("decrypted result saved to output file")
 
 
@@ -244,23 +307,28 @@ def encrypt(
         ..., envvar="TENSEAL_CONTEXT", help="file to load the TenSEAL context from"
     ),
     input_file: typer.FileBinaryRead = typer.Argument(
-        ..., help="file to load the numpy tensor to encrypt from"
+        ..., help="file to load the numpy tensor to encrypt from (in numpy .npy format)"
     ),
-    output_file: typer.FileBinaryWrite = typer.Argument(
-        ..., help="file to save the encrypted tensor to"
+    output_file: Path = typer.Argument(
+        ...,
+        dir_okay=False,
+        callback=check_output_path,
+        help="file to save the encrypted tensor to (- for stdout)",
     ),
     file_type: str = typer.Option(
         "", "--type", "-t", help="type of the file to encode"
     ),
     method: str = typer.Option("", "--method", "-m", help="encoding method to use"),
 ):
-    """Encrypt a pickled numpy tensor"""
+    """Encrypt a numpy tensor saved with numpy.save"""
+
+    import numpy as np
 
     ctx, _ = load_ctx_and_input(context_file, None)
     try:
-        tensor = pickle.load(input_file)
+        tensor = np.load(input_file, allow_pickle=False)
     except Exception as e:
-        typer.echo(f"Error while unpickling tensor: {str(e)}", err=True)
+        typer.echo(f"Error while loading tensor: {str(e)}", err=True)
         raise typer.Exit(code=1)
 
     if not isinstance(tensor, np.ndarray):
@@ -277,14 +345,18 @@ def encrypt(
     log("tensor encoded")
     enc_vec = ts.ckks_vector(ctx, vec)
     log("tensor encrypted")
-    output_file.write(enc_vec.serialize())
+    with open_output(output_file) as f:
+        f.write(enc_vec.serialize())
     log("saved encrypted tensor")
 
 
 @app.command()
 def create_context(
-    output_file: typer.FileBinaryWrite = typer.Argument(
-        ..., help="file to save the context to"
+    output_file: Path = typer.Argument(
+        ...,
+        dir_okay=False,
+        callback=check_output_path,
+        help="file to save the context to (- for stdout)",
     ),
     poly_modulus_degree: int = typer.Argument(
         ..., help="polynomial modulus degree", callback=check_power_of_two
@@ -327,7 +399,8 @@ def create_context(
         ctx.make_context_public()
         log("secret key dropped")
 
-    output_file.write(ctx.serialize())
+    with open_output(output_file) as f:
+        f.write(ctx.serialize())
     log("context saved successfully!")
 
 
@@ -0,0 +1,188 @@
+"""Asynchronous client to run concurrent evaluations with the server"""
+
+from typing import Union
+import httpx
+import tenseal as ts
+from eeval.client.client import PING_TIMEOUT, Client, _serialize
+
+
+class AsyncClient:
+    """Asynchronous client to request server for evaluation.
+
+    Requests are sent over a pool of keep-alive connections, so multiple evaluations can be
+    awaited concurrently (e.g. using asyncio.gather) instead of paying a roundtrip each.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        max_connections: int = 64,
+        http2: bool = False,
+    ):
+        """
+        Args:
+            hostname: hostname of the server
+            port: port the server is listening on
+            max_connections: maximum number of connections opened with the server
+            http2: multiplex requests over HTTP/2 connections, requires httpx[http2] and a
+                server (or proxy in front of it) speaking HTTP/2
+        """
+        self._base_url = f"http://{hostname}:{port}"
+        # evaluations can take a while, so don't timeout like the synchronous client
+        self._client = httpx.AsyncClient(
+            base_url=self._base_url,
+            limits=httpx.Limits(max_connections=max_connections),
+            timeout=None,
+            http2=http2,
+        )
+
+    async def close(self):
+        """Close the connections opened with the API"""
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def ping(self) -> bool:
+        """Make sure the API is up
+
+        Returns:
+            bool: True if the API is up, False otherwise
+        """
+        try:
+            response = await self._client.head("/ping", timeout=PING_TIMEOUT)
+        except httpx.HTTPError:
+            return False
+
+        return response.status_code == 200
+
+    async def evaluate(
+        self,
+        model_name: str,
+        context: ts._ts_cpp.TenSEALContext,
+        ckks_vector: Union[ts._ts_cpp.CKKSVector, bytes],  # serialized or not
+    ) -> ts._ts_cpp.CKKSVector:
+        """Evaluate model `model_name` on the encrypted input data `ckks_vector`
+
+        Args:
+            model_name: the model name to use for evaluation
+            context: TenSEALContext containing keys needed for evaluation
+            ckks_vector: encrypted input to feed the model with
+
+        Returns:
+            tenseal.CKKSVector: encrypted output of the evaluation
+
+        Raises:
+            ConnectionError: if a connection can't be established with the API
+            Answer418: if response.status_code is 418
+            ServerError: if response.status_code is 500
+        """
+        files = {
+            "context": ("context", _serialize(context), "application/octet-stream"),
+            "ckks_vector": (
+                "ckks_vector",
+                _serialize(ckks_vector),
+                "application/octet-stream",
+            ),
+        }
+        return await self._evaluate(model_name, context, files=files)
+
+    async def evaluate_by_id(
+        self,
+        model_name: str,
+        context_id: str,
+        ckks_vector: Union[ts._ts_cpp.CKKSVector, bytes],  # serialized or not
+        context: ts._ts_cpp.TenSEALContext,
+    ) -> ts._ts_cpp.CKKSVector:
+        """Evaluate model `model_name` on the encrypted input data `ckks_vector` using a
+        previously registered context. Only the input is sent to the server.
+
+        Args:
+            model_name: the model name to use for evaluation
+            context_id: id of a previously registered context
+            ckks_vector: encrypted input to feed the model with
+            context: TenSEALContext used to load the encrypted output
+
+        Returns:
+            tenseal.CKKSVector: encrypted output of the evaluation
+
+        Raises:
+            ConnectionError: if a connection can't be established with the API
+            ResourceNotFound: if the context identified with `context_id` can't be found
+            Answer418: if response.status_code is 418
+            ServerError: if response.status_code is 500
+        """
+        data = {"context_id": context_id}
+        files = {
+            "ckks_vector": (
+                "ckks_vector",
+                _serialize(ckks_vector),
+                "application/octet-stream",
+            ),
+        }
+        return await self._evaluate(model_name, context, data=data, files=files)
+
+    async def register_context(
+        self, context: Union[ts._ts_cpp.TenSEALContext, bytes],  # serialized or not
+    ) -> str:
+        """Register a context in the server and get an id to refer to it
+
+        Args:
+            context: TenSEALContext to register
+
+        Returns:
+            str: id to use to refer to the registered context
+
+        Raises:
+            ConnectionError: if a connection can't be established with the API
+            Answer418: if response.status_code is 418
+            ServerError: if response.status_code is 500
+        """
+        files = {
+            "context": ("context", _serialize(context), "application/octet-stream"),
+        }
+        response = await self._request("POST", "/contexts/register", files=files)
+        return response.json()["context_id"]
+
+    async def get_context(self, context_id: str) -> ts._ts_cpp.TenSEALContext:
+        """Get a previously registered context using it's id
+
+        Args:
+            context_id: id referring to the previously saved context
+
+        Returns:
+            TenSEALContext: the context identified with `context_id`
+
+        Raises:
+            ConnectionError: if a connection can't be established with the API
+            ResourceNotFound: if the context identified with `context_id` can't be found
+            Answer418: if response.status_code is 418
+            ServerError: if response.status_code is 500
+        """
+        response = await self._request(
+            "GET", "/contexts/", params={"context_id": context_id}
+        )
+        return ts.context_from(response.content)
+
+    async def _evaluate(
+        self, model_name: str, context: ts._ts_cpp.TenSEALContext, **kwargs
+    ) -> ts._ts_cpp.CKKSVector:
+        """Post an evaluation request and load its encrypted output"""
+        response = await self._request("POST", f"/eval/{model_name}", **kwargs)
+        return ts.ckks_vector_from(context, response.content)
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request and raise the client exceptions if it doesn't succeed"""
+        try:
+            response = await self._client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            raise ConnectionError
+
+        if response.status_code != 200:
+            Client._handle_error_response(response)
+
+        return response
@@ -1,17 +1,186 @@
 """Client implementing the communication with the server"""
 
-from typing import List, Union, Tuple
+import struct
+import uuid
+from itertools import chain
+from typing import Iterable, Iterator, List, Union, Tuple
+from weakref import WeakKeyDictionary
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
 import tenseal as ts
-from base64 import b64encode, b64decode
 from eeval.client.exceptions import *
 
+# use the faster JSON parser if available
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+# optional request compression
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# seconds to wait for the API to answer a ping
+PING_TIMEOUT = 2
+# request bodies smaller than this are sent uncompressed, zstd doesn't gain much on them
+MIN_COMPRESSED_SIZE = 16 * 1024
+# length prefix of each serialized CKKSVector when streaming datasets
+FRAME_HEADER = struct.Struct("<Q")
+
+
+def _serialize(
+    obj: Union[ts._ts_cpp.TenSEALContext, ts._ts_cpp.CKKSVector, bytes]
+) -> bytes:
+    """Serialize a TenSEAL object, return it as is if it's already serialized"""
+    if isinstance(obj, bytes):
+        return obj
+    return obj.serialize()
+
+
+def _read_exactly(stream, size: int) -> bytes:
+    """Read `size` bytes from `stream`, less bytes are only returned if the stream ends"""
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size, decode_content=True)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _read_frames(stream) -> Iterator[bytes]:
+    """Read length-prefixed frames from a urllib3 response stream until it ends
+
+    Raises:
+        ConnectionError: if the stream ends in the middle of a frame
+    """
+    while True:
+        header = _read_exactly(stream, FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) != FRAME_HEADER.size:
+            raise ConnectionError("response ended in the middle of a frame")
+        (length,) = FRAME_HEADER.unpack(header)
+        frame = _read_exactly(stream, length)
+        if len(frame) != length:
+            raise ConnectionError("response ended in the middle of a frame")
+        yield frame
+
+
+def _split_frames(data: bytes) -> Iterator[bytes]:
+    """Split a buffer of length-prefixed frames
+
+    Raises:
+        ConnectionError: if the buffer ends in the middle of a frame
+    """
+    offset = 0
+    while offset < len(data):
+        if offset + FRAME_HEADER.size > len(data):
+            raise ConnectionError("response ended in the middle of a frame")
+        (length,) = FRAME_HEADER.unpack_from(data, offset)
+        offset += FRAME_HEADER.size
+        if offset + length > len(data):
+            raise ConnectionError("response ended in the middle of a frame")
+        yield data[offset : offset + length]
+        offset += length
+
+
+def _iter_multipart(
+    boundary: str, fields: dict, files: Iterable[Tuple[str, bytes]]
+) -> Iterator[bytes]:
+    """Yield a multipart/form-data body part by part, so the file contents are sent as they are
+    instead of being copied into one big body first"""
+    for name, value in fields.items():
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode()
+    for name, content in files:
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"; filename="{name}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        # an empty chunk would end a chunked request early
+        if content:
+            yield content
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+class _MultipartBody:
+    """multipart/form-data body made of its parts, its length is known so it's sent with a
+    Content-Length instead of chunked encoding, and it can be sent again on retries"""
+
+    def __init__(
+        self, boundary: str, fields: dict, files: Iterable[Tuple[str, bytes]]
+    ):
+        self._parts = list(_iter_multipart(boundary, fields, files))
+
+    def __len__(self) -> int:
+        return sum(map(len, self._parts))
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self._parts)
+
 
 class Client:
     """Client to request server for evaluation"""
 
-    def __init__(self, hostname: str, port: int):
+    def __init__(self, hostname: str, port: int, compress: bool = False):
+        """
+        Args:
+            hostname: hostname of the server
+            port: port the server is listening on
+            compress: compress request bodies using zstd, requires zstandard on both ends
+
+        Raises:
+            ImportError: if compress is set but zstandard isn't installed
+        """
         self._base_url = f"http://{hostname}:{port}"
+        # endpoints, precomputed once instead of on every request
+        self._ping_url = self._base_url + "/ping"
+        self._models_url = self._base_url + "/models/"
+        self._eval_url = self._base_url + "/eval/"
+        self._eval_batch_url = self._base_url + "/eval_batch/"
+        self._contexts_url = self._base_url + "/contexts/"
+        self._register_context_url = self._base_url + "/contexts/register"
+        self._datasets_url = self._base_url + "/datasets/"
+        self._register_dataset_url = self._base_url + "/datasets/register"
+        if compress and zstandard is None:
+            raise ImportError("request compression requires the zstandard package")
+        self._compressor = zstandard.ZstdCompressor(level=3) if compress else None
+        # keep connections alive between requests, and retry connections that can't be
+        # established. Read errors are never retried, so a server that doesn't answer fails
+        # fast (ping keeps to PING_TIMEOUT), and requests are never sent twice once they
+        # reached the server
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, read=0, backoff_factor=0.1),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # advertise every encoding urllib3 can decode (zstd needs urllib3>=2 and zstandard)
+        self._session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        # serialized contexts, reused across requests made with the same context
+        self._serialized_contexts = WeakKeyDictionary()
+
+    def close(self):
+        """Close the connections opened with the API"""
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def ping(self) -> bool:
         """Make sure the API is up
@@ -19,17 +188,15 @@ class Client:
         Returns:
             bool: True if the API is up, False otherwise
         """
-        url = self._base_url + "/ping"
+        url = self._ping_url
         try:
-            response = requests.get(url)
-        except:
-            return False
-        if response.status_code != 200:
-            return False
-        elif response.json() != {"message": "pong"}:
+            # an API that is up answers right away, don't hang on a dead one.
+            # The status code is enough, no need to get the body
+            response = self._session.head(url, timeout=PING_TIMEOUT)
+        except requests.RequestException:
             return False
 
-        return True
+        return response.status_code == 200
 
     def list_models(self) -> List[dict]:
         """List the models available in the API
@@ -41,12 +208,12 @@ class Client:
         Raises:
             ConnectionError: if a connection can't be established with the API
         """
-        url = self._base_url + "/models/"
+        url = self._models_url
         try:
-            response = requests.get(url)
+            response = self._session.get(url)
         except requests.exceptions.ConnectionError:
             raise ConnectionError
-        models = response.json()
+        models = json_loads(response.content)
         return models
 
     def model_info(self, model_name: str) -> dict:
@@ -63,16 +230,16 @@ class Client:
             Answer418: if response.status_code is 418
             ServerError: if response.status_code is 500
         """
-        url = self._base_url + f"/models/{model_name}"
+        url = self._models_url + model_name
         try:
-            response = requests.get(url)
+            response = self._session.get(url)
         except requests.exceptions.ConnectionError:
             raise ConnectionError
 
         if response.status_code != 200:
             Client._handle_error_response(response)
 
-        model_info = response.json()
+        model_info = json_loads(response.content)
         return model_info
 
     def evaluate(
@@ -97,35 +264,121 @@ class Client:
             ServerError: if response.status_code is 500
         """
 
-        url = self._base_url + f"/eval/{model_name}"
+        url = self._eval_url + model_name
 
-        # don't serialize if already
-        if not isinstance(context, bytes):
-            ser_ctx = context.serialize()
-        else:
-            ser_ctx = context
-        if not isinstance(ckks_vector, bytes):
-            ser_vec = ckks_vector.serialize()
-        else:
-            ser_vec = ckks_vector
+        ser_ctx = self._serialize_context(context)
+        ser_vec = _serialize(ckks_vector)
+
+        # send raw bytes, no need for base64
+        files = [("context", ser_ctx), ("ckks_vector", ser_vec)]
+
+        try:
+            response = self._post_multipart(url, files=files)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionError
+
+        if response.status_code != 200:
+            Client._handle_error_response(response)
+
+        result = ts.ckks_vector_from(context, response.content)
+        return result
+
+    def evaluate_by_id(
+        self,
+        model_name: str,
+        context_id: str,
+        ckks_vector: Union[ts._ts_cpp.CKKSVector, bytes],  # serialized or not
+        context: ts._ts_cpp.TenSEALContext,
+    ) -> ts._ts_cpp.CKKSVector:
+        """Evaluate model `model_name` on the encrypted input data `ckks_vector` using a
+        previously registered context. Only the input is sent to the server.
+
+        Args:
+            model_name: the model name to use for evaluation
+            context_id: id of a previously registered context
+            ckks_vector: encrypted input to feed the model with
+            context: TenSEALContext used to load the encrypted output
+
+        Returns:
+            tenseal.CKKSVector: encrypted output of the evaluation
+
+        Raises:
+            ConnectionError: if a connection can't be established with the API
+            ResourceNotFound: if the context identified with `context_id` can't be found
+            Answer418: if response.status_code is 418
+            ServerError: if response.status_code is 500
+        """
+
+        url = self._eval_url + model_name
 
-        data = {
-            "context": b64encode(ser_ctx).decode(),
-            "ckks_vector": b64encode(ser_vec).decode(),
-        }
+        ser_vec = _serialize(ckks_vector)
+
+        fields = {"context_id": context_id}
+        files = [("ckks_vector", ser_vec)]
 
         try:
-            response = requests.post(url, json=data)
+            response = self._post_multipart(url, fields=fields, files=files)
         except requests.exceptions.ConnectionError:
             raise ConnectionError
 
         if response.status_code != 200:
             Client._handle_error_response(response)
 
-        ser_result = response.json()["ckks_vector"]
-        result = ts.ckks_vector_from(context, b64decode(ser_result))
+        result = ts.ckks_vector_from(context, response.content)
         return result
 
+    def evaluate_batch(
+        self,
+        model_name: str,
+        context: Union[ts._ts_cpp.TenSEALContext, bytes],  # serialized or not
+        ckks_vectors: List[Union[ts._ts_cpp.CKKSVector, bytes]],  # serialized or not
+        chunk_size: int = 64,
+    ) -> List[ts._ts_cpp.CKKSVector]:
+        """Evaluate model `model_name` on multiple encrypted inputs. Inputs are sent by chunks,
+        each chunk is evaluated in a single request, loading the context only once.
+
+        Args:
+            model_name: the model name to use for evaluation
+            context: TenSEALContext containing keys needed for evaluation
+            ckks_vectors: encrypted inputs to feed the model with
+            chunk_size: maximum number of inputs to send in a single request
+
+        Returns:
+            List[tenseal.CKKSVector]: encrypted outputs of the evaluation, in the inputs order
+
+        Raises:
+            ValueError: if chunk_size < 1
+            ConnectionError: if a connection can't be established with the API
+            Answer418: if response.status_code is 418
+            ServerError: if response.status_code is 500
+        """
+
+        if chunk_size < 1:
+            raise ValueError("chunk_size need to be greater or equal than 1")
+
+        url = self._eval_batch_url + model_name
+
+        ser_ctx = self._serialize_context(context)
+
+        results = []
+        for start in range(0, len(ckks_vectors), chunk_size):
+            chunk = ckks_vectors[start : start + chunk_size]
+            files = [("context", ser_ctx)]
+            files += [("ckks_vectors", x) for x in map(_serialize, chunk)]
+
+            try:
+                response = self._post_multipart(url, files=files)
+            except requests.exceptions.ConnectionError:
+                raise ConnectionError
+
+            if response.status_code != 200:
+                Client._handle_error_response(response)
+
+            outputs = _split_frames(response.content)
+            results += [ts.ckks_vector_from(context, out) for out in outputs]
+
+        return results
+
     def register_context(
         self, context: Union[ts._ts_cpp.TenSEALContext, bytes],  # serialized or not
     ) -> str:
@@ -143,27 +396,21 @@ class Client:
             ServerError: if response.status_code is 500
         """
 
-        url = self._base_url + f"/contexts/register"
+        url = self._register_context_url
 
-        # don't serialize if already
-        if not isinstance(context, bytes):
-            ser_ctx = context.serialize()
-        else:
-            ser_ctx = context
+        ser_ctx = self._serialize_context(context)
 
-        data = {
-            "context": b64encode(ser_ctx).decode(),
-        }
+        files = [("context", ser_ctx)]
 
         try:
-            response = requests.post(url, json=data)
+            response = self._post_multipart(url, files=files)
         except requests.exceptions.ConnectionError:
             raise ConnectionError
 
         if response.status_code != 200:
             Client._handle_error_response(response)
 
-        return response.json()["context_id"]
+        return json_loads(response.content)["context_id"]
 
     def get_context(self, ctx_id: str,) -> ts._ts_cpp.TenSEALContext:
         """Get a previously registered context using a context_id
@@ -181,19 +428,18 @@ class Client:
             ServerError: if response.status_code is 500
         """
 
-        url = self._base_url + f"/contexts/"
+        url = self._contexts_url
         data = {"context_id": ctx_id}
 
         try:
-            response = requests.get(url, params=data)
+            response = self._session.get(url, params=data)
         except requests.exceptions.ConnectionError:
             raise ConnectionError
 
         if response.status_code != 200:
             Client._handle_error_response(response)
 
-        ser_ctx = response.json()["context"]
-        ctx = ts.context_from(b64decode(ser_ctx))
+        ctx = ts.context_from(response.content)
 
         return ctx
 
@@ -224,12 +470,13 @@ class Client:
             ValueError: 
                 - if batch_size < 1
                 - if context or context_id are both set or not set
+                - if enc_X and enc_Y don't have the same length
             ConnectionError: if a connection can't be established with the API
             Answer418: if response.status_code is 418
             ServerError: if response.status_code is 500
         """
 
-        url = self._base_url + f"/datasets/register"
+        url = self._register_dataset_url
 
         if not isinstance(batch_size, int):
             raise TypeError("batch_size need to be an int")
@@ -238,6 +485,8 @@ class Client:
 
         if context is not None and context_id is not None:
             raise ValueError("context and context_id can't be both set")
+        if len(enc_X) != len(enc_Y):
+            raise ValueError("enc_X and enc_Y need to have the same length")
 
         # register context if passed
         if context is not None:
@@ -245,35 +494,26 @@ class Client:
         elif context_id is None:
             raise ValueError("context or context_id need to be set")
 
-        ser_X, ser_Y = [], []
-        for x, y in zip(enc_X, enc_Y):
-            if not isinstance(x, bytes):
-                ser_x = x.serialize()
-            else:
-                ser_x = x
-            if not isinstance(y, bytes):
-                ser_y = y.serialize()
-            else:
-                ser_y = y
-            ser_X.append(ser_x)
-            ser_Y.append(ser_y)
-
-        data = {
-            "context_id": context_id,
-            "X": [b64encode(x).decode() for x in ser_X],
-            "Y": [b64encode(y).decode() for y in ser_Y],
-            "batch_size": batch_size,
-        }
+        fields = {"context_id": context_id, "batch_size": batch_size}
+        # stream the body using chunked encoding, it can get as big as the whole dataset
+        boundary = uuid.uuid4().hex
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+        # vectors are serialized one at a time, as the body is being sent
+        files = chain(
+            (("X", _serialize(x)) for x in enc_X), (("Y", _serialize(y)) for y in enc_Y)
+        )
+        body = _iter_multipart(boundary, fields, files)
 
         try:
-            response = requests.post(url, json=data)
+            response = self._post(url, data=body, headers=headers)
         except requests.exceptions.ConnectionError:
             raise ConnectionError
 
         if response.status_code != 200:
             Client._handle_error_response(response)
 
-        dataset_id = response.json()["dataset_id"]
+        dataset_id = json_loads(response.content)["dataset_id"]
         return (context_id, dataset_id)
 
     def get_dataset(
@@ -295,37 +535,97 @@ class Client:
             ServerError: if response.status_code is 500
         """
 
-        url = self._base_url + f"/datasets/"
+        url = self._datasets_url
         data = {"dataset_id": dataset_id}
 
         try:
-            response = requests.get(url, params=data)
+            response = self._session.get(url, params=data, stream=True)
         except requests.exceptions.ConnectionError:
             raise ConnectionError
 
-        if response.status_code != 200:
-            Client._handle_error_response(response)
+        with response:
+            if response.status_code != 200:
+                Client._handle_error_response(response)
+
+            ctx_id = response.headers["X-Context-Id"]
+            batch_size = int(response.headers["X-Batch-Size"])
+            # vectors are loaded as their frames are received
+            vectors = [
+                ts.ckks_vector_from(context, frame)
+                for frame in _read_frames(response.raw)
+            ]
 
-        resp_json = response.json()
-        ctx_id = resp_json["context_id"]
-        batch_size = resp_json["batch_size"]
-        enc_X, enc_Y = [], []
-        for x_buff, y_buff in zip(resp_json["X"], resp_json["Y"]):
-            x = ts.ckks_vector_from(context, b64decode(x_buff))
-            y = ts.ckks_vector_from(context, b64decode(y_buff))
-            enc_X.append(x)
-            enc_Y.append(y)
+        # frames alternate between features and labels
+        enc_X, enc_Y = vectors[0::2], vectors[1::2]
 
         return ctx_id, enc_X, enc_Y, batch_size
 
+    def _post(self, url: str, **kwargs) -> requests.Response:
+        """Send a POST request, compressing its body if compression is enabled and the body
+        is large enough"""
+        if self._compressor is None:
+            return self._session.post(url, **kwargs)
+
+        request = self._session.prepare_request(requests.Request("POST", url, **kwargs))
+        # the size of streamed bodies isn't always known, those are always compressed
+        if hasattr(request.body, "__len__") and len(request.body) < MIN_COMPRESSED_SIZE:
+            return self._session.send(request)
+
+        # bodies are always streamed, compress them chunk by chunk
+        request.body = self._compress_chunks(request.body)
+        request.headers.pop("Content-Length", None)
+        request.headers["Transfer-Encoding"] = "chunked"
+        request.headers["Content-Encoding"] = "zstd"
+        return self._session.send(request)
+
+    def _post_multipart(
+        self, url: str, files: List[Tuple[str, bytes]], fields: dict = None
+    ) -> requests.Response:
+        """Send a multipart/form-data POST request, the file contents are written to the
+        connection as they are instead of being copied into a single body"""
+        boundary = uuid.uuid4().hex
+        body = _MultipartBody(boundary, fields or {}, files)
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        return self._post(url, data=body, headers=headers)
+
+    def _compress_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Compress a streamed body into a single zstd frame"""
+        compressor = self._compressor.compressobj()
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            # an empty chunk would end a chunked request early
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    def _serialize_context(
+        self, context: Union[ts._ts_cpp.TenSEALContext, bytes]
+    ) -> bytes:
+        """Serialize a context, reusing the result of a previous call with the same context.
+
+        The cached bytes are dropped if the context loses its secret key or changes its scale,
+        contexts modified in other ways (e.g. generating new keys) should be passed serialized.
+        """
+        if isinstance(context, bytes):
+            return context
+
+        state = (context.is_private(), context.global_scale)
+        cached = self._serialized_contexts.get(context)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+
+        ser_ctx = context.serialize()
+        self._serialized_contexts[context] = (state, ser_ctx)
+        return ser_ctx
+
     @staticmethod
     def _handle_error_response(response: requests.Response):
         """Handle the responses that aren't a success (200)"""
         if response.status_code == 404:
-            error_msg = response.json()["message"]
+            error_msg = json_loads(response.content)["message"]
             raise ResourceNotFound(error_msg)
         elif response.status_code == 418:
-            error_msg = response.json()["message"]
+            error_msg = json_loads(response.content)["message"]
             raise Answer418(error_msg)
         elif response.status_code == 500:
             raise ServerError("Server error")
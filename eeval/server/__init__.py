@@ -1,7 +1,14 @@
 """Server for hosting machine learning models to evaluate encrypted inputs"""
 
-from eeval.server.main import start
 from eeval.server.models import register_model
 
 
+def start(host="127.0.0.1", port=8000):
+    """Start the API server. The web stack is only imported from here, so importing eeval
+    (e.g. for the client or the CLI) doesn't pay for loading it"""
+    from eeval.server.main import start
+
+    start(host=host, port=port)
+
+
 __all__ = ["start"]
@@ -0,0 +1,163 @@
+"""Support for zstd compressed request and response bodies"""
+
+import io
+import zstandard
+from starlette.responses import PlainTextResponse
+
+
+# responses smaller than this aren't worth compressing
+MINIMUM_SIZE = 1024
+# ciphertexts are already compressed by SEAL, only text responses gain from it. Now that
+# datasets are sent as raw bytes instead of base64 JSON, that's mostly the model listings and
+# the OpenAPI schema, other JSON responses are below MINIMUM_SIZE
+COMPRESSIBLE_TYPES = (b"application/json",)
+# zstd compressed request bodies can't be, or decompress to, more than this, so small requests
+# can't be made to allocate unbounded memory
+MAXIMUM_BODY_SIZE = 256 * 1024 * 1024
+
+
+class ZstdMiddleware:
+    """ASGI middleware handling zstd content-encoding:
+    - request bodies sent with `Content-Encoding: zstd` are decompressed, endpoints then receive
+      the body as if it was sent uncompressed. Compressed bodies larger than `maximum_body_size`,
+      before or after decompression, are rejected with a 413. Uncompressed bodies aren't limited
+    - request bodies sent with any other content-encoding, including stacked ones like
+      `gzip, zstd`, are rejected with a 415
+    - JSON responses are compressed if the client sent `Accept-Encoding: zstd`
+    """
+
+    def __init__(self, app, maximum_body_size: int = MAXIMUM_BODY_SIZE):
+        self.app = app
+        self.maximum_body_size = maximum_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = scope["headers"]
+        if b"zstd" in _header_values(headers, b"accept-encoding"):
+            send = _CompressedSend(send)
+
+        content_encoding = _header_values(headers, b"content-encoding")
+        if content_encoding in (b"", b"identity"):
+            await self.app(scope, receive, send)
+            return
+        if content_encoding != b"zstd":
+            response = PlainTextResponse(
+                "unsupported content-encoding, only zstd is", status_code=415
+            )
+            await response(scope, receive, send)
+            return
+
+        too_large = PlainTextResponse("request body too large", status_code=413)
+
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > self.maximum_body_size:
+                await too_large(scope, receive, send)
+                return
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+
+        # decompress by bounded pieces, to stop as soon as the output gets too large instead of
+        # allocating all of it first. This also handles frames that don't hold the content size,
+        # and bodies made of multiple concatenated frames
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(b"".join(chunks)), read_across_frames=True
+        )
+        chunks = []
+        size = 0
+        try:
+            while True:
+                chunk = reader.read(zstandard.DECOMPRESSION_RECOMMENDED_OUTPUT_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.maximum_body_size:
+                    await too_large(scope, receive, send)
+                    return
+                chunks.append(chunk)
+        except zstandard.ZstdError:
+            response = PlainTextResponse("bad zstd compressed body", status_code=400)
+            await response(scope, receive, send)
+            return
+        body = b"".join(chunks)
+
+        headers = [
+            (name, value)
+            for name, value in headers
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        scope = dict(scope, headers=headers)
+
+        body_sent = False
+
+        async def receive_decompressed():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, receive_decompressed, send)
+
+
+class _CompressedSend:
+    """Wrap an ASGI send callable to compress single-message JSON responses"""
+
+    def __init__(self, send):
+        self._send = send
+        self._start_message = None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            # wait for the body to decide whether to compress or not
+            self._start_message = message
+            return
+
+        if message["type"] == "http.response.body" and self._start_message is not None:
+            start_message, self._start_message = self._start_message, None
+            body = message.get("body", b"")
+            if (
+                not message.get("more_body", False)
+                and len(body) >= MINIMUM_SIZE
+                and _is_compressible(start_message["headers"])
+            ):
+                body = zstandard.ZstdCompressor(level=3).compress(body)
+                headers = [
+                    (name, value)
+                    for name, value in start_message["headers"]
+                    if name != b"content-length"
+                ]
+                headers += [
+                    (b"content-encoding", b"zstd"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"vary", b"Accept-Encoding"),
+                ]
+                await self._send(dict(start_message, headers=headers))
+                await self._send({"type": "http.response.body", "body": body})
+                return
+            await self._send(start_message)
+
+        await self._send(message)
+
+
+def _is_compressible(headers) -> bool:
+    if _header_values(headers, b"content-encoding"):
+        return False
+    content_type = _header_values(headers, b"content-type")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _header_values(headers, header_name: bytes) -> bytes:
+    """Get the lowercased values of a header, joined by commas if it's repeated"""
+    return b",".join(
+        value.strip().lower() for name, value in headers if name == header_name
+    )
@@ -1,22 +1,58 @@
 """RESTful API providing the main evaluation service"""
 
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import tenseal as ts
 import uvicorn
+from collections import OrderedDict
 from enum import Enum
-from typing import List
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from typing import Iterator, List
+from fastapi import FastAPI, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
-from eeval.server.models import get_model, get_all_model_def, get_model_def
+from eeval.server.models import (
+    get_model,
+    get_all_model_def,
+    get_model_def,
+    load_all_models,
+    Model,
+)
 from eeval.server.models.exceptions import *
 from eeval.server import storage
-from base64 import b64encode, b64decode
-
 
-BENCHMARK = True
+# use the faster JSON serializer if available
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as JSONResponse
+except ImportError:
+    from fastapi.responses import JSONResponse
+# accept zstd compressed requests if zstandard is available
+try:
+    from eeval.server.compression import ZstdMiddleware
+except ImportError:
+    ZstdMiddleware = None
+
+
+# time every request, opt-in as it adds work (and a log line) to each of them
+BENCHMARK = os.environ.get("EEVAL_BENCHMARK", "0") not in ("", "0")
 CORS = True
+# length prefix of each serialized CKKSVector when streaming datasets
+FRAME_HEADER = struct.Struct("<Q")
+# maximum number of contexts sent with requests to keep deserialized
+MAX_INLINE_CONTEXTS = 32
+# contexts sent with requests: {blake2b digest: future of the deserialized context}
+INLINE_CONTEXTS = OrderedDict()
+# maximum number of evaluation outputs to keep for repeated requests
+MAX_CACHED_OUTPUTS = 32
+# outputs of recent evaluations: {(model, context digest or id, input digest): output}
+CACHED_OUTPUTS = OrderedDict()
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=JSONResponse)
 
 if BENCHMARK:
     from fastapi import Request
@@ -24,11 +60,13 @@ if BENCHMARK:
 
     @app.middleware("http")
     async def add_process_time_header(request: Request, call_next):
-        tick = time.time()
+        tick = time.perf_counter()
         response = await call_next(request)
-        tock = time.time()
-        process_time = tock - tick
-        print(f"Calling {request.url} took {process_time} seconds")
+        process_time = time.perf_counter() - tick
+        # uvicorn's logger, already set up to output info messages
+        logging.getLogger("uvicorn.error").info(
+            f"Calling {request.url} took {process_time} seconds"
+        )
         response.headers["X-Process-Time"] = str(process_time)
         return response
 
@@ -45,32 +83,14 @@ if CORS:
     )
 
 
-class CKKSVector(BaseModel):
-    ckks_vector: str = Field(
-        ..., description="Serialized CKKSVector representing the input to the model"
-    )
-
-
-class Context(BaseModel):
-    context: str = Field(
-        ...,
-        description="Serialized TenSEALContext containing the keys needed for the evaluation",
-    )
+if ZstdMiddleware is not None:
+    app.add_middleware(ZstdMiddleware)
 
 
-class CKKSVectorWithContext(CKKSVector, Context):
-    pass
-
-
-class Dataset(BaseModel):
-    context_id: str = Field(..., description="id of the context used with this dataset")
-    X: List[str] = Field(
-        ..., description="Serialized CKKSVectors representing the data features"
-    )
-    Y: List[str] = Field(
-        ..., description="Serialized CKKSVectors representing the data labels"
-    )
-    batch_size: int = Field(1, min=1, description="Number of entries per CKKSVector")
+@app.on_event("startup")
+def warm_up():
+    """Load models before serving, instead of stalling the first request to each of them"""
+    load_all_models()
 
 
 class ModelDescription(BaseModel):
@@ -100,10 +120,24 @@ def answer_404(msg: str):
     )
 
 
+# rendered model descriptions: {model_name or None for all models: (description, json)}
+_RENDERED_DESCRIPTIONS = {}
+
+
+def render_description(key: str, description) -> Response:
+    """Render a model description to JSON once, and reuse it as long as the description object
+    is the same (descriptions are cached until a new model is registered)"""
+    cached = _RENDERED_DESCRIPTIONS.get(key)
+    if cached is None or cached[0] is not description:
+        cached = (description, JSONResponse(content=description).body)
+        _RENDERED_DESCRIPTIONS[key] = cached
+    return Response(content=cached[1], media_type="application/json")
+
+
 @app.get("/models/", response_model=List[ModelDescription])
 async def list_models():
     """List available models with their description"""
-    return get_all_model_def()
+    return render_description(None, get_all_model_def())
 
 
 @app.get("/models/{model_name}", response_model=ModelDescription)
@@ -113,51 +147,193 @@ async def describe_model(model_name: str):
         model_def = get_model_def(model_name)
     except ModelNotFound as mnf:
         return answer_418(str(mnf))
-    return model_def
+    return render_description(model_name, model_def)
+
+
+def digest(data: bytes) -> bytes:
+    """Identify serialized data by its blake2b digest"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+async def load_inline_context(
+    context: bytes, context_digest: bytes = None
+) -> ts._ts_cpp.TenSEALContext:
+    """Deserialize a context sent with a request. Requests sending the same context share a
+    single deserialization, even when they arrive concurrently"""
+    if context_digest is None:
+        context_digest = digest(context)
+    loading = INLINE_CONTEXTS.get(context_digest)
+    if loading is None:
+        loading = asyncio.ensure_future(run_in_threadpool(ts.context_from, context))
+        INLINE_CONTEXTS[context_digest] = loading
+        if len(INLINE_CONTEXTS) > MAX_INLINE_CONTEXTS:
+            INLINE_CONTEXTS.popitem(last=False)
+    else:
+        INLINE_CONTEXTS.move_to_end(context_digest)
+
+    try:
+        # shielded, a cancelled request shouldn't cancel the others waiting on the same context
+        return await asyncio.shield(loading)
+    except Exception:
+        # don't keep failures around
+        if INLINE_CONTEXTS.get(context_digest) is loading:
+            del INLINE_CONTEXTS[context_digest]
+        raise
+
+
+def run_model(model: Model, context, ckks_vector: bytes) -> bytes:
+    """Deserialize the input, evaluate `model` on it and serialize the output"""
+    encrypted_x = model.prepare_input(context, ckks_vector)
+    return model(encrypted_x).serialize()
 
 
-# TODO:
-# - use data (files?) instead of json to not have the need to base64
-# - optionally use a context_id. May serve performing multiple evaluations
 @app.post(
     "/eval/{model_name}",
-    response_model=CKKSVector,
-    response_description="encrypted output of the model",
+    response_class=Response,
+    response_description="serialized CKKSVector holding the encrypted output of the model",
 )
-async def evaluation(data: CKKSVectorWithContext, model_name: str, version: str = None):
+async def evaluation(
+    model_name: str,
+    version: str = None,
+    context: bytes = File(
+        None,
+        description="Serialized TenSEALContext containing the keys needed for the evaluation",
+    ),
+    context_id: str = Form(
+        None, description="id of a previously registered context to use instead"
+    ),
+    ckks_vector: bytes = File(
+        ..., description="Serialized CKKSVector representing the input to the model"
+    ),
+):
     """
     Evaluate encrypted input data using the model `model_name` (optionally using a specific `version`)
 
     - **ckks_vector**: a serialized CKKSVector representing the input to the model
     - **context**: a serialized TenSEALContext containing the keys needed for the evaluation
+    - **context_id**: id of a previously registered context, to avoid sending the context each time
+
+    Both are sent as raw bytes in a multipart/form-data body, the output is sent back as raw bytes
+    """
+
+    # fetch model, before the context so requests to unknown models don't deserialize it
+    try:
+        model = get_model(model_name, version)
+    except ModelNotFound as mnf:
+        return answer_418(str(mnf))
+    except Exception:
+        raise HTTPException(status_code=500)
+
+    if context is not None:
+        context_key = digest(context)
+    elif context_id is not None:
+        context_key = context_id
+    else:
+        return answer_418("context or context_id need to be set")
+
+    # retried requests send the same input again, answer them without loading the context or
+    # evaluating twice. Contexts are identified by digest or id, keeping the context objects
+    # alive would defeat the bounds of the context caches
+    cache_key = (model, context_key, digest(ckks_vector))
+    encrypted_out = CACHED_OUTPUTS.get(cache_key)
+    if encrypted_out is not None:
+        CACHED_OUTPUTS.move_to_end(cache_key)
+        return Response(content=encrypted_out, media_type="application/octet-stream")
+
+    # fetch context, contexts are kept deserialized so their keys aren't loaded each time
+    try:
+        if context is not None:
+            context = await load_inline_context(context, context_key)
+        else:
+            context = storage.load_context(context_id)
+    except KeyError:
+        return answer_404(f"No context with id {context_id}")
+    except Exception:
+        return answer_418("cannot deserialize context")
+
+    # deserialize input and do the evaluation in the threadpool. TenSEAL holds the GIL while
+    # computing, so other requests are still mostly stalled until the evaluation is done
+    try:
+        encrypted_out = await run_in_threadpool(run_model, model, context, ckks_vector)
+    except (DeserializationError, EvaluationError, InvalidContext) as error:
+        return answer_418(str(error))
+
+    CACHED_OUTPUTS[cache_key] = encrypted_out
+    if len(CACHED_OUTPUTS) > MAX_CACHED_OUTPUTS:
+        CACHED_OUTPUTS.popitem(last=False)
+
+    return Response(content=encrypted_out, media_type="application/octet-stream")
+
+
+@app.post(
+    "/eval_batch/{model_name}",
+    response_class=Response,
+    response_description="serialized CKKSVectors holding the encrypted outputs of the model",
+)
+async def batch_evaluation(
+    model_name: str,
+    version: str = None,
+    context: bytes = File(
+        None,
+        description="Serialized TenSEALContext containing the keys needed for the evaluation",
+    ),
+    context_id: str = Form(
+        None, description="id of a previously registered context to use instead"
+    ),
+    ckks_vectors: List[bytes] = File(
+        ..., description="Serialized CKKSVectors representing the inputs to the model"
+    ),
+):
+    """
+    Evaluate multiple encrypted inputs using the model `model_name` (optionally using a specific
+    `version`), the context is only sent and loaded once for all of them
+
+    - **ckks_vectors**: serialized CKKSVectors representing the inputs to the model
+    - **context**: a serialized TenSEALContext containing the keys needed for the evaluation
+    - **context_id**: id of a previously registered context, to avoid sending the context each time
+
+    The outputs are sent back in the same order as the inputs, each one prefixed with its length
+    as an unsigned 64-bit little-endian integer
     """
 
-    # fetch model
+    # fetch model, before the context so requests to unknown models don't deserialize it
     try:
         model = get_model(model_name, version)
     except ModelNotFound as mnf:
         return answer_418(str(mnf))
-    except:
+    except Exception:
         raise HTTPException(status_code=500)
 
-    # decode data from client
+    # fetch context
     try:
-        context = b64decode(data.context)
-        ckks_vector = b64decode(data.ckks_vector)
-    except:
-        return answer_418("bad base64 strings")
+        if context is not None:
+            context = await load_inline_context(context)
+        elif context_id is not None:
+            context = storage.load_context(context_id)
+        else:
+            return answer_418("context or context_id need to be set")
+    except KeyError:
+        return answer_404(f"No context with id {context_id}")
+    except Exception:
+        return answer_418("cannot deserialize context")
 
-    # deserialize input and do the evaluation
+    # deserialize inputs and do the evaluations in the threadpool, one at a time (TenSEAL holds
+    # the GIL, running them concurrently wouldn't be faster)
+    frames = []
     try:
-        encrypted_x = model.prepare_input(context, ckks_vector)
-        encrypted_out = model(encrypted_x)
+        for ckks_vector in ckks_vectors:
+            encrypted_out = await run_in_threadpool(
+                run_model, model, context, ckks_vector
+            )
+            frames.append(FRAME_HEADER.pack(len(encrypted_out)))
+            frames.append(encrypted_out)
     except (DeserializationError, EvaluationError, InvalidContext) as error:
         return answer_418(str(error))
 
-    return {"ckks_vector": b64encode(encrypted_out.serialize())}
+    return Response(content=b"".join(frames), media_type="application/octet-stream")
 
 
-@app.get("/ping")
+@app.api_route("/ping", methods=["GET", "HEAD"])
 async def ping():
     """Used to check if the API is up"""
     return {"message": "pong"}
@@ -166,14 +342,13 @@ async def ping():
 @app.post(
     "/contexts/register", response_description="id of the registered context",
 )
-async def register_context(data: Context):
+async def register_context(
+    context: bytes = File(
+        ...,
+        description="Serialized TenSEALContext containing the keys needed for the evaluation",
+    )
+):
     """Register a context and get a context_id to refer to it"""
-    # decode data from client
-    try:
-        context = b64decode(data.context)
-    except:
-        return answer_418("bad base64 strings")
-
     # TODO: try except possible exceptions
     ctx_id = storage.save_context(context)
     return {"context_id": ctx_id}
@@ -181,61 +356,80 @@ async def register_context(data: Context):
 
 @app.get(
     "/contexts/",
-    response_model=Context,
+    response_class=Response,
     response_description="A previously registered context referenced by `context_id`",
 )
 async def get_context(context_id: str):
-    """Get a previously registered context"""
+    """Get a previously registered context, sent back as raw bytes"""
     try:
         ctx = storage.get_raw_context(context_id)
     except KeyError:
         return answer_404(f"No context with id {context_id}")
-    return {
-        "context": b64encode(ctx),
-    }
+    return Response(content=ctx, media_type="application/octet-stream")
 
 
 @app.post(
     "/datasets/register", response_description="id of the registered dataset",
 )
-async def register_dataset(data: Dataset):
+async def register_dataset(
+    # files need to be declared first, FastAPI decides how to read the whole form from the
+    # first parameter, and would leave files unread if it's a Form
+    X: List[bytes] = File(
+        ..., description="Serialized CKKSVectors representing the data features"
+    ),
+    Y: List[bytes] = File(
+        ..., description="Serialized CKKSVectors representing the data labels"
+    ),
+    context_id: str = Form(..., description="id of the context used with this dataset"),
+    batch_size: int = Form(1, ge=1, description="Number of entries per CKKSVector"),
+):
     """Register a dataset and get a dataset_id to refer to it"""
-    # decode data from client
-    try:
-        enc_X = []
-        enc_Y = []
-        for x, y in zip(data.X, data.Y):
-            enc_X.append(b64decode(x))
-            enc_Y.append(b64decode(y))
-    except:
-        return answer_418("bad base64 strings")
+    if len(X) != len(Y):
+        return answer_418("X and Y must have the same number of CKKSVectors")
 
     # TODO: try except possible exceptions
-    dataset_id = storage.save_dataset(data.context_id, enc_X, enc_Y, data.batch_size)
+    dataset_id = storage.save_dataset(context_id, X, Y, batch_size)
     return {"dataset_id": dataset_id}
 
 
+def iter_frames(X: List[bytes], Y: List[bytes]) -> Iterator[bytes]:
+    """Yield length-prefixed serialized CKKSVectors, alternating between features and labels"""
+    for x, y in zip(X, Y):
+        yield FRAME_HEADER.pack(len(x))
+        yield x
+        yield FRAME_HEADER.pack(len(y))
+        yield y
+
+
 @app.get(
     "/datasets/",
-    response_model=Dataset,
+    response_class=StreamingResponse,
     response_description="A previously registered dataset referenced by `dataset_id`",
 )
 async def get_dataset(dataset_id: str):
-    """Get a previously registered dataset"""
+    """
+    Get a previously registered dataset
+
+    The body is a stream of serialized CKKSVectors (x_0, y_0, x_1, y_1, ...), each one prefixed
+    with its length as an unsigned 64-bit little-endian integer. The id of the context and the
+    batch size are sent in the `X-Context-Id` and `X-Batch-Size` headers
+    """
     try:
         ctx_id, X, Y, batch_size = storage.get_raw_dataset(dataset_id)
     except KeyError:
         return answer_404(f"No dataset with id {dataset_id}")
-    return {
-        "context_id": ctx_id,
-        "X": [b64encode(x) for x in X],
-        "Y": [b64encode(y) for y in Y],
-        "batch_size": batch_size,
-    }
+    return StreamingResponse(
+        iter_frames(X, Y),
+        media_type="application/octet-stream",
+        headers={"X-Context-Id": ctx_id, "X-Batch-Size": str(batch_size)},
+    )
 
 
 def start(host="127.0.0.1", port=8000):
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    # uvicorn picks uvloop and httptools when they are installed (eeval[speedups]).
+    # A single process is used: contexts, datasets and models only live in its memory. TenSEAL
+    # holds the GIL, so evaluations don't run in parallel within it
+    uvicorn.run(app, host=host, port=port)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,22 @@
 """Define models to process encrypted data"""
 import os
 import logging
+import importlib.util
 import pickle
 from typing import List
 from inspect import isclass
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threading import Lock
 from eeval.server.models.abstract_model import Model
 from eeval.server.models.linear_layer import LinearLayer
 from eeval.server.models.exceptions import ModelNotFound
 
+# optional support for parameters saved as safetensors, only looked up here as importing it
+# imports numpy
+_HAS_SAFETENSORS = importlib.util.find_spec("safetensors") is not None
+
 
 _DEFAULT_DATA_DIR = os.path.join(os.path.realpath(os.path.dirname(__file__)), "data")
 
@@ -24,23 +32,31 @@ _MODEL_DEFS = {
     #     data_dir="/some/path/here",
     # )
 }
-# cache model versions, set initially to one, then lazy loaded on demand
+# cache model versions, set initially to None, then lazy loaded on demand
 _MODELS_CACHE = {
-    # model_name: {
-    #     model_version: None for model_version in _MODEL_DEFS[model_name].versions
-    # }
+    # (model_name, model_version): None
     # for model_name in _MODEL_DEFS.keys()
+    # for model_version in _MODEL_DEFS[model_name].versions
+}
+
+# locks making sure a model version is only loaded once when requested from multiple threads
+_MODELS_LOCKS = {
+    # (model_name, model_version): Lock()
 }
 
-# TODO: maybe add a decorator for this functionality
 def register_model(
-    constructor_class,
-    versions: List[str],
+    constructor_class=None,
+    versions: List[str] = None,
     model_name: str = None,
     default_version: str = None,
     data_dir: str = None,
 ):
-    """Register a model to serve in the API
+    """Register a model to serve in the API. If constructor_class is not set, return a class
+    decorator registering the decorated class instead:
+
+        @register_model(versions=["0.1"])
+        class MyModel(Model):
+            ...
 
     Args:
         constructor_class: class derived from eeval.server.models.abstract_model.Model
@@ -48,10 +64,11 @@ def register_model(
         model_name: name of the model to register it with. Default is the class name
         default_versions: the default version to use. Set to the first element of versions if None
         data_dir: path to the directory to load parameters from, parameters files should be named
-            {model_name}-{version}.pickle and can be unpickled. Use default folder if None
+            {model_name}-{version}.{ext} where ext is one of safetensors (requires safetensors),
+            npz (saved with numpy.savez) or pickle. Use default folder if None
 
     Returns:
-        str: the name of the model registered
+        str: the name of the model registered, or the decorator if constructor_class is not set
 
     Raises:
         TypeError: constructor_class is not a subclass of models.abstract_model.Model
@@ -59,13 +76,21 @@ def register_model(
         FolderNotFound: folder not found
         FileNotFound: versions file not found
     """
+    if constructor_class is None:
+
+        def decorator(cls):
+            register_model(cls, versions, model_name, default_version, data_dir)
+            return cls
+
+        return decorator
+
     if not isclass(constructor_class):
         raise TypeError("constructor_class must be class")
     if not issubclass(constructor_class, Model):
         raise TypeError(
             "constructor_class is not a subclass of models.abstract_model.Model"
         )
-    if len(versions) == 0:
+    if not versions:
         raise ValueError("versions can't be an empty list")
 
     if default_version is None:
@@ -86,10 +111,20 @@ def register_model(
         data_dir=data_dir,
     )
 
+    # drop the versions of a previously registered model with the same name
+    for key in [key for key in _MODELS_CACHE if key[0] == model_name]:
+        del _MODELS_CACHE[key]
+        del _MODELS_LOCKS[key]
     # add entries for each version in the cache
-    _MODELS_CACHE[model_name] = {
-        model_version: None for model_version in _MODEL_DEFS[model_name].versions
-    }
+    for model_version in versions:
+        _MODELS_CACHE[(model_name, model_version)] = None
+        _MODELS_LOCKS[(model_name, model_version)] = Lock()
+
+    # descriptions are cached, they need to be rebuilt to include the new model
+    get_model_def.cache_clear()
+    get_all_model_def.cache_clear()
+
+    return model_name
 
 
 def set_default_data_dir(path: str):
@@ -100,6 +135,33 @@ def set_default_data_dir(path: str):
     return _DEFAULT_DATA_DIR
 
 
+def _load_npz(file_path: str) -> dict:
+    # imported here, this module is imported on every CLI start
+    import numpy as np
+
+    # models get lists, like from pickled parameters, that's what TenSEAL accepts
+    with np.load(file_path, allow_pickle=False) as archive:
+        return {name: array.tolist() for name, array in archive.items()}
+
+
+def _load_safetensors(file_path: str) -> dict:
+    from safetensors.numpy import load_file
+
+    return {name: array.tolist() for name, array in load_file(file_path).items()}
+
+
+def _load_pickle(file_path: str) -> dict:
+    with open(file_path, "rb") as f:
+        return pickle.load(f)
+
+
+# parameter loaders by file extension, in order of preference. Tensor formats are read directly
+# instead of walking a pickled object graph, which is also unsafe with untrusted files
+_PARAMETERS_LOADERS = {".npz": _load_npz, ".pickle": _load_pickle}
+if _HAS_SAFETENSORS:
+    _PARAMETERS_LOADERS = {".safetensors": _load_safetensors, **_PARAMETERS_LOADERS}
+
+
 def _load_parameters(model_name: str, version: str) -> dict:
     """Load parameters for `model_name`:`version` from the appropriate file.
 
@@ -113,13 +175,17 @@ def _load_parameters(model_name: str, version: str) -> dict:
     Raises:
         OSError: if can't open parameters' file
     """
-    file_name = f"{model_name}-{version}.pickle"
     data_dir = _MODEL_DEFS[model_name].data_dir
     if data_dir is None:
         data_dir = _DEFAULT_DATA_DIR
-    file_path = os.path.realpath(os.path.join(data_dir, file_name))
+    base_path = os.path.realpath(os.path.join(data_dir, f"{model_name}-{version}"))
+    # use the first format available, falling back to pickle
+    for extension, loader in _PARAMETERS_LOADERS.items():
+        file_path = base_path + extension
+        if os.path.exists(file_path):
+            break
     try:
-        parameters = pickle.load(open(file_path, "rb"))
+        parameters = loader(file_path)
         print(f"Model `{model_name}` version `{version}` loaded from '{file_path}'")
     except OSError as ose:
         logging.error(
@@ -144,25 +210,56 @@ def get_model(model_name: str, version: str = None) -> Model:
     """
 
     # check if (model_name, version) is available
-    if model_name not in _MODEL_DEFS.keys():
+    model_definition = _MODEL_DEFS.get(model_name)
+    if model_definition is None:
         raise ModelNotFound(f"Model `{model_name}` can't be found in this server")
     if version is None:
-        version = _MODEL_DEFS[model_name].default_version
-    elif version not in _MODEL_DEFS[model_name].versions:
+        version = model_definition.default_version
+    elif version not in model_definition.versions:
         raise ModelNotFound(f"Model `{model_name}` doesn't have version `{version}`")
 
     # lazy loading of models
-    if _MODELS_CACHE[model_name][version] is None:
-        parameters = _load_parameters(model_name, version)
-        _MODELS_CACHE[model_name][version] = _MODEL_DEFS[model_name].constructor(
-            parameters
-        )
+    key = (model_name, version)
+    model = _MODELS_CACHE[key]
+    if model is None:
+        with _MODELS_LOCKS[key]:
+            # might have been loaded while waiting for the lock
+            model = _MODELS_CACHE[key]
+            if model is None:
+                parameters = _load_parameters(model_name, version)
+                model = model_definition.constructor(parameters)
+                _MODELS_CACHE[key] = model
 
-    return _MODELS_CACHE[model_name][version]
+    return model
 
 
+def load_all_models(max_workers: int = None):
+    """Load every version of the registered models, so the first requests don't have to.
+    Models are loaded in parallel, failing ones are logged and left to be loaded on demand.
+
+    Args:
+        max_workers: maximum number of models to load at the same time
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            (model_name, version): executor.submit(get_model, model_name, version)
+            for model_name, model_def in _MODEL_DEFS.items()
+            for version in model_def.versions
+        }
+
+    for (model_name, version), future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(
+                f"Failed to load model `{model_name}` version `{version}`: {e}"
+            )
+
+
+@lru_cache(maxsize=None)
 def get_model_def(model_name: str) -> dict:
-    """Get descriptive attributes of model `model_name`.
+    """Get descriptive attributes of model `model_name`. The result is cached, and shouldn't
+    be modified.
 
     Args:
         model_name: the name of the model
@@ -186,6 +283,7 @@ def get_model_def(model_name: str) -> dict:
     }
 
 
+@lru_cache(maxsize=None)
 def get_all_model_def() -> List[dict]:
     """Get the description of all the available model"""
     model_defs = [get_model_def(model_name) for model_name in _MODEL_DEFS]
@@ -197,6 +295,7 @@ __all__ = [
     "get_model_def",
     "get_model",
     "LinearLayer",
+    "load_all_models",
     "Model",
     "register_model",
     "set_default_data_dir",
@@ -1,7 +1,7 @@
 """Abstract model that defines mandatory model methods"""
 
 from typing import Dict
-from abc import ABC, abstractmethod, abstractstaticmethod
+from abc import ABC, abstractmethod
 import tenseal as ts
 
 
@@ -26,12 +26,16 @@ class Model(ABC):
         """
         pass
 
-    @abstractstaticmethod
-    def prepare_input(context: bytes, ckks_vector: bytes) -> ts._ts_cpp.CKKSVector:
+    @staticmethod
+    @abstractmethod
+    def prepare_input(
+        context: ts._ts_cpp.TenSEALContext, ckks_vector: bytes
+    ) -> ts._ts_cpp.CKKSVector:
         """Deserialize input and check if the parameters are appropriate for the model
 
         Args:
-            context: TenSEALContext with keys required for the computation
+            context: TenSEALContext with keys required for the computation, already
+                deserialized by the server
             ckks_vector: CKKSVector representing the model input
 
         Returns:
@@ -43,4 +47,5 @@ class Model(ABC):
         pass
 
     def __call__(self, *args, **kwargs):
+        # subclasses can set `__call__ = forward` to skip this extra call
         return self.forward(*args, **kwargs)
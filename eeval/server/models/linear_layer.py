@@ -16,30 +16,46 @@ class LinearLayer(Model):
     """
 
     def __init__(self, parameters):
-        # parameters is the unpickled version file
-        self.weight = parameters["weight"]
-        self.bias = parameters["bias"]
+        # parameters is the loaded version file. TenSEAL converts its operands to C++ vectors on
+        # every call, which is much faster from plain lists than element by element from arrays,
+        # so convert them once here. numpy is imported here, this module is imported on every
+        # CLI start
+        import numpy as np
+
+        self.weight = np.asarray(parameters["weight"], dtype=np.float64).tolist()
+        self.bias = np.asarray(parameters["bias"], dtype=np.float64).tolist()
 
     def forward(self, enc_x: ts._ts_cpp.CKKSVector) -> ts._ts_cpp.CKKSVector:
+        if enc_x.size() != len(self.weight):
+            raise EvaluationError(
+                f"expected an input of size {len(self.weight)}, got {enc_x.size()}"
+            )
         try:
-            out = enc_x.mm(self.weight) + self.bias
+            out = enc_x.mm(self.weight)
+            # add the bias in place, instead of allocating another ciphertext
+            out.add_plain_(self.bias)
         except Exception as e:
             raise EvaluationError(f"{e.__class__.__name__}: {str(e)}")
         return out
 
+    # evaluate directly, without going through Model.__call__
+    __call__ = forward
+
     @staticmethod
-    def prepare_input(context: bytes, ckks_vector: bytes) -> ts._ts_cpp.CKKSVector:
+    def prepare_input(
+        context: ts._ts_cpp.TenSEALContext, ckks_vector: bytes
+    ) -> ts._ts_cpp.CKKSVector:
         # TODO: check parameters or size and raise InvalidParameters when needed
+        # check the context before deserializing the input, so invalid requests fail early
+        # TODO: replace this with a more flexible check when introduced in the API
         try:
-            ctx = ts.context_from(context)
-            enc_x = ts.ckks_vector_from(ctx, ckks_vector)
+            _ = context.galois_keys()
         except:
-            raise DeserializationError("cannot deserialize context or ckks_vector")
+            raise InvalidContext("the context doesn't hold galois keys")
 
-        # TODO: replace this with a more flexible check when introduced in the API
         try:
-            _ = ctx.galois_keys()
+            enc_x = ts.ckks_vector_from(context, ckks_vector)
         except:
-            raise InvalidContext("the context doesn't hold galois keys")
+            raise DeserializationError("cannot deserialize ckks_vector")
 
         return enc_x
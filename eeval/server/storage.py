@@ -1,16 +1,26 @@
 # TODO: use db like redis with TTL
+from collections import OrderedDict, namedtuple
 from typing import List, Tuple
 from eeval.server.utils import get_random_id
 import tenseal as ts
 
+raw_dataset = namedtuple("raw_dataset", ["ctx_id", "X", "Y", "batch_size"])
+
 DATASETS = {
-    # dataset_id: [ctx_id, X, Y, batch_size]
+    # dataset_id: raw_dataset(ctx_id, X, Y, batch_size)
 }
 
 CONTEXTS = {
     # ctx_id: context
 }
 
+# maximum number of contexts kept deserialized
+MAX_LOADED_CONTEXTS = 32
+# recently used contexts, deserialized once instead of loading their keys on every use
+LOADED_CONTEXTS = OrderedDict(
+    # ctx_id: TenSEALContext, from least to most recently used
+)
+
 
 def save_context(context: bytes) -> str:
     """Save a context into a permanent storage"""
@@ -20,9 +30,17 @@ def save_context(context: bytes) -> str:
 
 
 def load_context(ctx_id: str) -> ts._ts_cpp.TenSEALContext:
-    """Load a TenSEALContext"""
+    """Load a TenSEALContext, the most recently used ones are only deserialized once"""
+    ctx = LOADED_CONTEXTS.get(ctx_id)
+    if ctx is not None:
+        LOADED_CONTEXTS.move_to_end(ctx_id)
+        return ctx
+
     context = get_raw_context(ctx_id)
     ctx = ts.context_from(context)
+    LOADED_CONTEXTS[ctx_id] = ctx
+    if len(LOADED_CONTEXTS) > MAX_LOADED_CONTEXTS:
+        LOADED_CONTEXTS.popitem(last=False)
     return ctx
 
 
@@ -33,7 +51,7 @@ def get_raw_context(ctx_id: str) -> bytes:
 def save_dataset(ctx_id: str, X: List[bytes], Y: List[bytes], batch_size: int) -> str:
     """Save a dataset into a permanent storage"""
     dataset_id = get_random_id()
-    DATASETS[dataset_id] = [ctx_id, X, Y, batch_size]
+    DATASETS[dataset_id] = raw_dataset(ctx_id, X, Y, batch_size)
     return dataset_id
 
 
@@ -53,6 +71,6 @@ def load_dataset(
     return ctx, enc_X, enc_Y, batch_size
 
 
-def get_raw_dataset(dataset_id: str) -> Tuple[str, List[bytes], List[bytes], int]:
-    ctx_id, X, Y, batch_size = DATASETS[dataset_id]
-    return ctx_id, X, Y, batch_size
+def get_raw_dataset(dataset_id: str) -> raw_dataset:
+    """Get a stored dataset as (ctx_id, X, Y, batch_size)"""
+    return DATASETS[dataset_id]
@@ -1,6 +1,5 @@
 from typing import Tuple, List
-from random import randint
-from binascii import hexlify
+from secrets import token_hex
 import tenseal as ts
 
 
@@ -8,5 +7,4 @@ TOKEN_LENGTH = 32
 
 
 def get_random_id():
-    rand_bytes = [randint(0, 255) for i in range(TOKEN_LENGTH)]
-    return hexlify(bytes(rand_bytes)).decode()
+    return token_hex(TOKEN_LENGTH)
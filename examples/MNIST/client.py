@@ -1,3 +1,4 @@
+import os
 import tenseal as ts
 import torch
 from eeval import Client
@@ -5,12 +6,22 @@ from PIL import Image
 from torchvision import transforms
 
 
+POLY_MOD_DEGREE = 8192
+COEFF_MOD_BIT_SIZES = [40, 21, 21, 21, 21, 21, 21, 40]
+# key generation is slow, so the context is saved and reused across runs
+CONTEXT_FILE = f"context-{POLY_MOD_DEGREE}-{'_'.join(map(str, COEFF_MOD_BIT_SIZES))}.bin"
+
+
 def create_ctx():
-    poly_mod_degree = 8192
-    coeff_mod_bit_sizes = [40, 21, 21, 21, 21, 21, 21, 40]
-    ctx = ts.context(ts.SCHEME_TYPE.CKKS, poly_mod_degree, -1, coeff_mod_bit_sizes)
+    if os.path.exists(CONTEXT_FILE):
+        with open(CONTEXT_FILE, "rb") as f:
+            return ts.context_from(f.read())
+
+    ctx = ts.context(ts.SCHEME_TYPE.CKKS, POLY_MOD_DEGREE, -1, COEFF_MOD_BIT_SIZES)
     ctx.global_scale = 2 ** 21
     ctx.generate_galois_keys()
+    with open(CONTEXT_FILE, "wb") as f:
+        f.write(ctx.serialize())
     return ctx
 
 
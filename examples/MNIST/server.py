@@ -41,19 +41,22 @@ class ConvMNIST(models.Model):
         out.mm_(self.fc2_weight).add_plain_(self.fc2_bias)
         return out
 
+    # evaluate directly, without going through Model.__call__
+    __call__ = forward
+
     @staticmethod
     def prepare_input(context, ckks_vector):
+        # check the context before deserializing the input, so invalid requests fail early
+        # TODO: replace this with a more flexible check when introduced in the API
         try:
-            ctx = ts.context_from(context)
-            enc_x = ts.ckks_vector_from(ctx, ckks_vector)
+            _ = context.galois_keys()
         except:
-            raise DeserializationError("cannot deserialize context or ckks_vector")
+            raise InvalidContext("the context doesn't hold galois keys")
 
-        # TODO: replace this with a more flexible check when introduced in the API
         try:
-            _ = ctx.galois_keys()
+            enc_x = ts.ckks_vector_from(context, ckks_vector)
         except:
-            raise InvalidContext("the context doesn't hold galois keys")
+            raise DeserializationError("cannot deserialize ckks_vector")
 
         return enc_x
 
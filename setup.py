@@ -12,6 +12,10 @@ setuptools.setup(
     author="Ayoub Benaissa",
     author_email="ayouben9@gmail.com",
     install_requires=read("requirements.txt").split("\n"),
+    extras_require={
+        "async": ["httpx"],
+        "speedups": ["httptools", "orjson", "uvloop", "zstandard>=0.15"],
+    },
     description="Client/Server framework for encrypted machine learning evaluation",
     long_description=read("README.md"),
     long_description_content_type="text/markdown",
@@ -0,0 +1,101 @@
+import os
+import pytest
+
+zstandard = pytest.importorskip("zstandard")
+# importing eeval loads the client and models, which need TenSEAL
+pytest.importorskip("tenseal")
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.testclient import TestClient
+from eeval.server.compression import MINIMUM_SIZE, ZstdMiddleware
+
+
+async def echo(request):
+    return Response(await request.body(), media_type="application/octet-stream")
+
+
+async def listing(request):
+    return JSONResponse(["model"] * MINIMUM_SIZE)
+
+
+@pytest.fixture
+def client():
+    app = Starlette()
+    app.add_route("/echo", echo, methods=["POST"])
+    app.add_route("/listing", listing)
+    app.add_middleware(ZstdMiddleware, maximum_body_size=1000)
+    return TestClient(app)
+
+
+def compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def test_compressed_body(client):
+    body = b"a" * 500
+    response = client.post(
+        "/echo", data=compress(body), headers={"Content-Encoding": "zstd"}
+    )
+    assert response.status_code == 200
+    assert response.content == body
+
+
+def test_uncompressed_body(client):
+    body = b"a" * 5000
+    response = client.post("/echo", data=body)
+    assert response.status_code == 200
+    assert response.content == body
+
+
+def test_multiple_frames(client):
+    body = compress(b"a" * 100) + compress(b"b" * 100)
+    response = client.post("/echo", data=body, headers={"Content-Encoding": "zstd"})
+    assert response.status_code == 200
+    assert response.content == b"a" * 100 + b"b" * 100
+
+
+def test_decompression_bomb(client):
+    body = compress(b"\0" * 10000)
+    assert len(body) < 1000
+    response = client.post("/echo", data=body, headers={"Content-Encoding": "zstd"})
+    assert response.status_code == 413
+
+
+def test_compressed_body_too_large(client):
+    body = compress(os.urandom(2000))
+    assert len(body) > 1000
+    response = client.post("/echo", data=body, headers={"Content-Encoding": "zstd"})
+    assert response.status_code == 413
+
+
+def test_bad_compressed_body(client):
+    response = client.post(
+        "/echo", data=b"not zstd at all", headers={"Content-Encoding": "zstd"}
+    )
+    assert response.status_code == 400
+
+
+def test_trailing_garbage(client):
+    body = compress(b"a" * 100) + b"garbage"
+    response = client.post("/echo", data=body, headers={"Content-Encoding": "zstd"})
+    assert response.status_code == 400
+
+
+def test_unsupported_encoding(client):
+    response = client.post(
+        "/echo", data=compress(b"a"), headers={"Content-Encoding": "gzip, zstd"}
+    )
+    assert response.status_code == 415
+
+
+def test_compressed_response(client):
+    response = client.get("/listing", headers={"Accept-Encoding": "zstd"}, stream=True)
+    assert response.headers["Content-Encoding"] == "zstd"
+    body = zstandard.ZstdDecompressor().decompressobj().decompress(response.raw.read())
+    assert body == JSONResponse(["model"] * MINIMUM_SIZE).body
+
+
+def test_small_responses_uncompressed(client):
+    response = client.post("/echo", data=b"a", headers={"Accept-Encoding": "zstd"})
+    assert "Content-Encoding" not in response.headers
+    assert response.content == b"a"
@@ -0,0 +1,37 @@
+import pytest
+
+ts = pytest.importorskip("tenseal")
+from fastapi.testclient import TestClient
+from eeval.client.client import _split_frames
+from eeval.server.main import app
+
+
+@pytest.fixture(scope="module")
+def context():
+    ctx = ts.context(ts.SCHEME_TYPE.CKKS, 8192, coeff_mod_bit_sizes=[60, 40, 40, 60])
+    ctx.global_scale = 2 ** 40
+    return ctx
+
+
+def test_register_then_get_dataset(context):
+    client = TestClient(app)
+    X = [ts.ckks_vector(context, [i, i + 1.0]).serialize() for i in range(3)]
+    Y = [ts.ckks_vector(context, [float(i)]).serialize() for i in range(3)]
+
+    response = client.post("/contexts/register", files={"context": context.serialize()})
+    assert response.status_code == 200
+    context_id = response.json()["context_id"]
+
+    files = [("X", x) for x in X] + [("Y", y) for y in Y]
+    data = {"context_id": context_id, "batch_size": "2"}
+    response = client.post("/datasets/register", data=data, files=files)
+    assert response.status_code == 200, response.text
+    dataset_id = response.json()["dataset_id"]
+
+    response = client.get("/datasets/", params={"dataset_id": dataset_id})
+    assert response.status_code == 200
+    assert response.headers["X-Context-Id"] == context_id
+    assert response.headers["X-Batch-Size"] == "2"
+    frames = list(_split_frames(response.content))
+    assert frames[0::2] == X
+    assert frames[1::2] == Y
@@ -0,0 +1,59 @@
+import pytest
+
+ts = pytest.importorskip("tenseal")
+from fastapi.testclient import TestClient
+from eeval.server import main
+from eeval.server.models import LinearLayer, register_model
+
+
+def make_context():
+    ctx = ts.context(ts.SCHEME_TYPE.CKKS, 8192, -1, [60, 40, 60])
+    ctx.global_scale = 2 ** 40
+    ctx.generate_galois_keys()
+    return ctx
+
+
+@pytest.fixture
+def evaluations(monkeypatch):
+    """Record the evaluations actually run by the server"""
+    register_model(LinearLayer, versions=["0.1"])
+    main.CACHED_OUTPUTS.clear()
+    calls = []
+    run_model = main.run_model
+
+    def recording_run_model(*args):
+        calls.append(args)
+        return run_model(*args)
+
+    monkeypatch.setattr(main, "run_model", recording_run_model)
+    return calls
+
+
+def evaluate(client, context, ckks_vector):
+    files = {"context": context.serialize(), "ckks_vector": ckks_vector}
+    response = client.post("/eval/LinearLayer", files=files)
+    assert response.status_code == 200, response.text
+    return response.content
+
+
+def test_repeated_evaluation_is_cached(evaluations):
+    client = TestClient(main.app)
+    context = make_context()
+    ckks_vector = ts.ckks_vector(context, [0.1] * 16).serialize()
+
+    first = evaluate(client, context, ckks_vector)
+    second = evaluate(client, context, ckks_vector)
+    assert second == first
+    assert len(evaluations) == 1
+
+
+def test_other_context_isnt_cached(evaluations):
+    client = TestClient(main.app)
+    context = make_context()
+    # same parameters, so the input can be loaded with either context
+    other_context = make_context()
+    ckks_vector = ts.ckks_vector(context, [0.1] * 16).serialize()
+
+    evaluate(client, context, ckks_vector)
+    evaluate(client, other_context, ckks_vector)
+    assert len(evaluations) == 2
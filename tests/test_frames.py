@@ -0,0 +1,42 @@
+import io
+import pytest
+
+pytest.importorskip("tenseal")
+from urllib3.response import HTTPResponse
+from eeval.client.client import FRAME_HEADER, _read_frames, _split_frames
+
+
+FRAMES = [b"first", b"", b"third frame"]
+DATA = b"".join(FRAME_HEADER.pack(len(frame)) + frame for frame in FRAMES)
+
+
+def stream(data: bytes) -> HTTPResponse:
+    return HTTPResponse(body=io.BytesIO(data), preload_content=False)
+
+
+def test_split_frames():
+    assert list(_split_frames(DATA)) == FRAMES
+    assert list(_split_frames(b"")) == []
+
+
+def test_read_frames():
+    assert list(_read_frames(stream(DATA))) == FRAMES
+    assert list(_read_frames(stream(b""))) == []
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        # in the middle of a header
+        DATA[: FRAME_HEADER.size // 2],
+        # in the middle of a frame
+        DATA[:-1],
+        # right after a header
+        DATA + FRAME_HEADER.pack(8),
+    ],
+)
+def test_truncated_frames(data):
+    with pytest.raises(ConnectionError):
+        list(_split_frames(data))
+    with pytest.raises(ConnectionError):
+        list(_read_frames(stream(data)))